@@ -4,27 +4,50 @@ import json
 import os
 import sys
 import uuid
-from urllib import request, error
+from http import client as http_client
+from urllib.parse import urlsplit
 
 API_URL = os.getenv("FIRSTLINE_API_URL", "http://localhost:8080")
 
+# One keep-alive connection for the whole test run instead of a fresh
+# TCP (+TLS, behind ngrok) handshake per call.
+_TARGET = urlsplit(API_URL)
+_CONN = None
+
+
+def _connection():
+    global _CONN
+    if _CONN is None:
+        conn_cls = (
+            http_client.HTTPSConnection
+            if _TARGET.scheme == "https"
+            else http_client.HTTPConnection
+        )
+        _CONN = conn_cls(_TARGET.netloc, timeout=30)
+    return _CONN
+
 
 def call(method, path, payload=None, token=None):
-    url = f"{API_URL}{path}"
-    data = None
-    headers = {"Content-Type": "application/json"}
+    global _CONN
+    headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
     if token:
         headers["Authorization"] = f"Bearer {token}"
-    if payload is not None:
-        data = json.dumps(payload).encode("utf-8")
-    req = request.Request(url, data=data, headers=headers, method=method)
-    try:
-        with request.urlopen(req, timeout=30) as res:
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    full_path = _TARGET.path.rstrip("/") + path
+    for attempt in (0, 1):
+        try:
+            conn = _connection()
+            conn.request(method, full_path, body=data, headers=headers)
+            res = conn.getresponse()
             body = res.read().decode("utf-8")
             return res.status, json.loads(body) if body else {}
-    except error.HTTPError as e:
-        body = e.read().decode("utf-8")
-        return e.code, json.loads(body) if body else {}
+        except (http_client.HTTPException, OSError):
+            # Stale keep-alive socket; reconnect once before giving up.
+            if _CONN is not None:
+                _CONN.close()
+                _CONN = None
+            if attempt:
+                raise
 
 
 def assert_ok(name, status, expected):